@@ -1,43 +1,63 @@
 import streamlit as st
+import uuid
 from datetime import datetime
-from backend.config import SUPABASE_URL, SUPABASE_KEY, PAPERS_TABLE, logger
-from backend.supabase_calls import create_supabase_client, get_papers, get_unique_filter_values, get_paper_markdown, insert_generation_to_db
-from frontend.fe_components import render_prompt_builder, render_compact_paper_list_pagination, render_save_generation_form
+from backend.config import PAPERS_TABLE, BATCH_API_KEY, logger
+from backend.supabase_calls import get_supabase, get_app_bootstrap, get_papers_markdown_batch, insert_generation_to_db, generation_cache_key, get_cached_generation, put_cached_generation
+from frontend.fe_components import render_prompt_builder, render_compact_paper_list_pagination, render_save_generation_form, set_selected_papers, current_page_key
 from backend.prompts import generate_prompt
-from backend.openrouter_calls import send_ai_request, parse_ai_response
+from backend.openrouter_calls import send_ai_request_stream, parse_ai_response, submit_batch, supports_batch
 
 logger.info("Starting ICLR Paper Browser application")
 
+PAPERS_PER_PAGE = 5
+
 def init_session_state():
     if 'supabase_client' not in st.session_state:
-        st.session_state.supabase_client = create_supabase_client(SUPABASE_URL, SUPABASE_KEY)
+        st.session_state.supabase_client = get_supabase()
         logger.info("Supabase client initialized")
     if 'selected_papers' not in st.session_state:
-        st.session_state.selected_papers = []
+        set_selected_papers([])
     if 'filtered_papers' not in st.session_state:
         st.session_state.filtered_papers = []
+    if 'total_papers' not in st.session_state:
+        st.session_state.total_papers = 0
+    if 'page_number' not in st.session_state:
+        st.session_state.page_number = 0
     if 'list_of_statuses' not in st.session_state or 'list_of_primary_areas' not in st.session_state:
-        statuses, areas = get_unique_filter_values(st.session_state.supabase_client, PAPERS_TABLE)
-        st.session_state.list_of_statuses = statuses
-        st.session_state.list_of_primary_areas = areas
+        # One roundtrip for the filter values and the first (unfiltered) page of papers
+        bootstrap = get_app_bootstrap(st.session_state.supabase_client, PAPERS_TABLE, page_size=PAPERS_PER_PAGE)
+        st.session_state.list_of_statuses = bootstrap['statuses']
+        st.session_state.list_of_primary_areas = bootstrap['areas']
+        st.session_state.search_filters = {"paper_status": None, "primary_area": None}
+        st.session_state.page_number = 0
+        st.session_state.filtered_papers = bootstrap['papers']
+        st.session_state.total_papers = bootstrap['total_count']
+        st.session_state.loaded_page_key = current_page_key()
         logger.info("Session state initialized with filter values")
     # Initialize prompt-related session state variables
     if 'prompt_saved' not in st.session_state:
         st.session_state.prompt_saved = False
-    if 'prompt_goal' not in st.session_state:
-        st.session_state.prompt_goal = ""
-    if 'prompt_return_format' not in st.session_state:
-        st.session_state.prompt_return_format = ""
-    if 'prompt_warnings' not in st.session_state:
-        st.session_state.prompt_warnings = ""
-    # if 'prompt_context_dump' not in st.session_state:
-    #     st.session_state.prompt_context_dump = ""
     if 'generating' not in st.session_state:
         st.session_state.generating = False
     # Add these in your init_session_state function
     if 'has_generated_content' not in st.session_state:
         st.session_state.has_generated_content = False
 
+def fetch_papers_with_content(selected):
+    """Get the content for all selected papers in one batch, keyed by paper id"""
+    markdown_by_id = get_papers_markdown_batch(
+        st.session_state.supabase_client,
+        [paper['id'] for paper in selected]
+    )
+    return {
+        paper['id']: {
+            'title': paper['title'],
+            'content': markdown_by_id[paper['id']]
+        }
+        for paper in selected
+        if markdown_by_id.get(paper['id'])
+    }
+
 def main():
     st.set_page_config(layout="wide")
     init_session_state()
@@ -69,6 +89,12 @@ def main():
             help="Select which AI model to use for generation"
         )
         st.session_state.selected_model = selected_model
+        st.checkbox(
+            "Reuse cached generations",
+            value=True,
+            key="use_generation_cache",
+            help="Untick to sample a fresh generation even if this exact prompt and model were generated before"
+        )
 
         st.header("Search Filters")
         status = st.selectbox("Paper Status", ["All"] + st.session_state.list_of_statuses)
@@ -78,21 +104,20 @@ def main():
 
 
     if search:
-        logger.info(f"Search requested - status: {status}, area: {area}")
-        st.session_state.filtered_papers = get_papers(
-            st.session_state.supabase_client, 
-            PAPERS_TABLE,
-            paper_status=None if status == "All" else status,
-            primary_area=None if area == "All" else area
-        )
-        logger.info(f"Found {len(st.session_state.filtered_papers)} papers")
+        logger.info("Search requested - status: %s, area: %s", status, area)
+        st.session_state.search_filters = {
+            "paper_status": None if status == "All" else status,
+            "primary_area": None if area == "All" else area
+        }
+        st.session_state.page_number = 0
 
     # Create two columns with equal width
     col1, col2 = st.columns([1,1])
     
     with col1:
         # First section: Compact paper list
-        render_compact_paper_list_pagination(st.session_state.filtered_papers, "Available Papers")
+        # Runs as a fragment: page navigation reruns only the list, not the whole app
+        render_compact_paper_list_pagination("Available Papers", papers_per_page=PAPERS_PER_PAGE)
         
         # Selected papers summary (small, just shows count and titles)
         with st.expander("Selected Papers", expanded=True):
@@ -100,7 +125,7 @@ def main():
             if len(st.session_state.selected_papers) > 2:
                 st.error("Maximum 2 papers allowed")
                 logger.warning("Too many papers selected")
-            for paper in st.session_state.selected_papers:
+            for paper in st.session_state.selected_papers.values():
                 st.write(f"• {paper['title']}")
         
         # Separator
@@ -110,7 +135,7 @@ def main():
         render_prompt_builder()
         
         # Buttons for actions
-        col1a, col1b = st.columns(2)
+        col1a, col1b, col1c = st.columns(3)
         with col1a:
             if st.button("Save Prompt", use_container_width=True):
                 saved_prompt = {
@@ -128,7 +153,7 @@ def main():
         
                 # Success message
                 st.success("Prompt saved!")
-                logger.info(f"Prompt saved to session state: {saved_prompt}")
+                logger.info("Prompt saved to session state: %s", saved_prompt)
                 st.session_state.prompt_saved = True
         
         with col1b:
@@ -141,38 +166,69 @@ def main():
                 st.session_state.content_generated = False
                 st.session_state.save_error = ""
                 st.session_state.tags_input = ""
+                # A save still running belongs to the previous generation; don't let it mark this one as saved
+                st.session_state.pop('save_future', None)
 
-                # Get the content for each selected paper
-                papers_with_content = {}
+                st.session_state.papers_with_content = fetch_papers_with_content(st.session_state.selected_papers.values())
 
-                for paper in st.session_state.selected_papers:
-                    paper_data = get_paper_markdown(st.session_state.supabase_client, paper['id'])
-                    if paper_data and paper_data.get('markdown_content'):
-                        papers_with_content[paper['id']] = {
-                            'title': paper['title'],
-                            'content': paper_data['markdown_content']
-                        }
-                
-                st.session_state.papers_with_content = papers_with_content
+        with col1c:
+            batch_model_supported = supports_batch(st.session_state.selected_model)
+            batch_disabled = submit_disabled or not BATCH_API_KEY or not batch_model_supported
+            batch_help = "Queue the generation on the Batch API (cheaper, results within 24h)"
+            if not batch_model_supported:
+                batch_help = f"{st.session_state.selected_model} is not available on the Batch API"
+            if st.button("Submit as Batch", disabled=batch_disabled, use_container_width=True, help=batch_help):
+                logger.info("Batch generation requested")
+                papers_with_content = fetch_papers_with_content(st.session_state.selected_papers.values())
+                if not papers_with_content:
+                    logger.error("No paper content could be retrieved for the batch")
+                    st.error("Could not retrieve the content of the selected papers. Please try again.")
+                else:
+                    prompt_generated = generate_prompt(
+                        papers_with_content=papers_with_content,
+                        goal=st.session_state.prompt_goal,
+                        return_format=st.session_state.prompt_return_format,
+                        directions=st.session_state.prompt_warnings
+                    )
+                    batch = submit_batch(
+                        [{"custom_id": uuid.uuid4().hex, "prompt": prompt_generated}],
+                        model=st.session_state.selected_model
+                    )
+                    if not batch['success']:
+                        st.error(f"Batch submission failed: {batch.get('error', 'Unknown error')}")
+                    # content_generated is filled in by batch_poller.py once the job completes
+                    elif insert_generation_to_db(
+                        supabase_client=st.session_state.supabase_client,
+                        run_id=st.session_state.get('run_id', ''),
+                        content_generated="",
+                        source_papers=list(papers_with_content),
+                        prompt_text=prompt_generated,
+                        model_used=st.session_state.selected_model,
+                        status="pending",
+                        batch_id=batch['batch_id']
+                    ):
+                        st.info("Queued — check back later")
+                    else:
+                        logger.error("Batch %s submitted but not recorded in the database", batch['batch_id'])
+                        st.error(f"Batch {batch['batch_id']} was submitted but could not be recorded, so its results won't be collected.")
             
     with col2:
         # Full column dedicated to output
         st.subheader("Generation")
-        logger.info("Rendering output column")
+        logger.debug("Rendering output column")
         
         if 'generating' in st.session_state and st.session_state.generating:
             if not st.session_state.get('content_generated', False):
 
-                logger.info(f"Generating state is True. Session state keys: {list(st.session_state.keys())}")
+                logger.debug("Generating state is True")
 
                 st.info("Starting markdown content fetch.")
                 if 'papers_with_content' in st.session_state and st.session_state.papers_with_content:
-                    logger.info(f"Found papers_with_content with {len(st.session_state.papers_with_content)} papers")
+                    logger.info("Found papers_with_content with %d papers", len(st.session_state.papers_with_content))
                     st.success(f"Retrieved content for {len(st.session_state.papers_with_content)} papers")
 
                     # Display a preview of each paper's content
                     for paper_id, paper_data in st.session_state.papers_with_content.items():
-                        logger.info(f"Rendering preview for paper: {paper_id}")
                         with st.expander(f"Paper: {paper_data['title']}", expanded=False):
                             content_preview = paper_data['content'][:500] + "..." if len(paper_data['content']) > 500 else paper_data['content']
                             st.markdown(content_preview)
@@ -186,7 +242,7 @@ def main():
                             directions=st.session_state.prompt_warnings
                         )
                         st.session_state.prompt_generated = prompt_generated
-                        logger.info(f"Prompt generated with length: {len(prompt_generated)}")
+                        logger.info("Prompt generated with length: %d", len(prompt_generated))
                         
                         if st.session_state.prompt_generated:
                             st.success(f"Prompt successfully generated.")
@@ -197,40 +253,73 @@ def main():
                     with st.expander(f"Prompt Generated.", expanded=False):
                         st.text(prompt_generated)
                     
-                    with st.spinner(f"Making model call."):
-                        logger.info(f"Sending request to model: {st.session_state.selected_model}")
-                        raw_model_response = send_ai_request(prompt=prompt_generated, model=st.session_state.selected_model, temperature=0.7)
-                        st.session_state.raw_model_response = raw_model_response
-                        logger.info("Raw model response received and stored in session state")
-                        
-                        # Parse the response
-                        logger.info("Parsing model response")
-                        parsed_response = parse_ai_response(raw_model_response)
-                        st.session_state.parsed_response = parsed_response
-                        logger.info(f"Response parsing success: {parsed_response['success']}")
+                    # Identical model + prompt was generated before: reuse it instead of calling the model
+                    cache_key = generation_cache_key(st.session_state.selected_model, prompt_generated)
+                    cached = None
+                    if st.session_state.use_generation_cache:
+                        cached = get_cached_generation(st.session_state.supabase_client, cache_key)
+                    if cached:
+                        # No tokens were spent on this run, so don't report (or save) the original call's usage
+                        st.session_state.raw_model_response = {
+                            'choices': [{'message': {'role': 'assistant', 'content': cached['content_generated']}}],
+                            'usage': {'total_tokens': 0, 'cached': True}
+                        }
+                        st.caption("Reused a cached generation for this exact prompt and model.")
+                        st.markdown(cached['content_generated'])
+                    else:
+                        logger.info("Sending request to model: %s", st.session_state.selected_model)
+                        # Render tokens as they arrive; the holder is filled with the full response once the stream ends
+                        st.session_state.raw_model_response = {}
+                        # The stream may back off on rate limits before the first token, so keep a spinner up meanwhile
+                        with st.spinner("Making model call."):
+                            st.write_stream(send_ai_request_stream(
+                                prompt=prompt_generated,
+                                model=st.session_state.selected_model,
+                                temperature=0.7,
+                                response_holder=st.session_state.raw_model_response
+                            ))
+                    raw_model_response = st.session_state.raw_model_response
+                    logger.info("Raw model response received and stored in session state")
+                    
+                    # Parse the response
+                    logger.info("Parsing model response")
+                    parsed_response = parse_ai_response(raw_model_response)
+                    st.session_state.parsed_response = parsed_response
+                    logger.info("Response parsing success: %s", parsed_response['success'])
 
-                        if parsed_response['success']:
-                            st.success("Generation successful!")
-                        else:
-                            logger.info(f"Generation failed: {parsed_response.get('error', 'Unknown error')}")
-                            st.error(f"Generation failed: {parsed_response.get('error', 'Unknown error')}")
+                    if parsed_response['success']:
+                        st.success("Generation successful!")
+                        if not cached:
+                            put_cached_generation(
+                                st.session_state.supabase_client,
+                                cache_key,
+                                parsed_response['content'],
+                                parsed_response['usage']
+                            )
+                    else:
+                        logger.info("Generation failed: %s", parsed_response.get('error', 'Unknown error'))
+                        st.error(f"Generation failed: {parsed_response.get('error', 'Unknown error')}")
                     
                     if 'parsed_response' in st.session_state and st.session_state.parsed_response:
-                        logger.info("Checking parsed_response in session state")
+                        logger.debug("Checking parsed_response in session state")
                         if st.session_state.parsed_response['success']:
-                            logger.info("Parsed response is successful, rendering output")
+                            logger.debug("Parsed response is successful, rendering output")
                             st.session_state.content_generated = True
                         else:
                             logger.info("Content already generated, showing save form")
+                else:
+                    logger.error("No paper content could be retrieved for the selected papers")
+                    st.error("Could not retrieve the content of the selected papers. Please try again.")
             
             if st.session_state.get('content_generated', False) and 'parsed_response' in st.session_state:
-                logger.info("Rendering previously generated output")
+                logger.debug("Rendering previously generated output")
 
                 with st.expander("Raw Model Response", expanded=False):
                     st.code(str(st.session_state.raw_model_response), language="json")
 
-                usage = st.session_state.parsed_response.get('usage', {}).get('total_tokens', 'unknown')
-                st.caption(f"Tokens used: {usage}")
+                usage = st.session_state.parsed_response.get('usage', {})
+                cached_note = " (reused cached generation)" if usage.get('cached') else ""
+                st.caption(f"Tokens used: {usage.get('total_tokens', 'unknown')}{cached_note}")
 
                 with st.expander("Generated Research Idea", expanded=False):
                     st.markdown(st.session_state.parsed_response['content'])
@@ -239,7 +328,7 @@ def main():
                 save_status = render_save_generation_form(
                     parsed_response=st.session_state.parsed_response,
                     run_id=st.session_state.run_id,
-                    selected_papers=st.session_state.selected_papers,
+                    selected_paper_ids=st.session_state.selected_paper_ids,
                     prompt_generated=None,
                     selected_model=st.session_state.selected_model,
                     supabase_client=st.session_state.supabase_client
@@ -249,7 +338,7 @@ def main():
                     if st.button("Clear panel"):
                         for k in ("generating","content_generated","save_successful","save_error"):
                             st.session_state[k] = False
-                        st.session_state.selected_papers = []
+                        set_selected_papers([])
                         if "tags_input" in st.session_state:
                             del st.session_state.tags_input
         else:
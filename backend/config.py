@@ -7,6 +7,15 @@ load_dotenv()
 
 # Openrouter Config
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Optional attribution headers for OpenRouter
+OPENROUTER_SITE_URL = os.getenv("OPENROUTER_SITE_URL")
+OPENROUTER_APP_NAME = os.getenv("OPENROUTER_APP_NAME", "ICLR Brain")
+
+# Batch API config (OpenAI-compatible files/batches endpoints; OpenRouter has no batch API)
+BATCH_API_URL = os.getenv("BATCH_API_URL", "https://api.openai.com/v1")
+BATCH_API_KEY = os.getenv("BATCH_API_KEY")
+# Model providers the batch endpoint can serve, matched against the app's "provider/model" ids
+BATCH_MODEL_PROVIDERS = os.getenv("BATCH_MODEL_PROVIDERS", "openai").split(",")
 
 # Supabase config
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -14,6 +23,8 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 # Table names
 PAPERS_TABLE = "ICLR_25_papers"
+GENERATIONS_TABLE = "Generations_table"
+GENERATION_CACHE_TABLE = "generation_cache"
 
 # Logger config
 logging.basicConfig(
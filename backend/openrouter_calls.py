@@ -1,53 +1,311 @@
-
-import requests
+import time
+import httpx
 import json
-from backend.config import OPENROUTER_API_KEY, logger
+from backend.config import OPENROUTER_API_KEY, OPENROUTER_SITE_URL, OPENROUTER_APP_NAME, BATCH_API_URL, BATCH_API_KEY, BATCH_MODEL_PROVIDERS, logger
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+def _build_headers():
+    """Auth header plus the optional OpenRouter app attribution headers"""
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}"
+    }
+    if OPENROUTER_SITE_URL:
+        headers["HTTP-Referer"] = OPENROUTER_SITE_URL
+    if OPENROUTER_APP_NAME:
+        headers["X-Title"] = OPENROUTER_APP_NAME
+    return headers
+
+def _build_payload(prompt, model, temperature, max_tokens):
+    """Request body shared by the plain, streaming and batch senders"""
+    payload = {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "temperature": temperature,
+        # Let OpenRouter pick the highest-throughput provider for the model
+        "provider": {"sort": "throughput"}
+    }
+    if max_tokens is not None:
+        payload["max_tokens"] = max_tokens
+    return payload
+
+# Rate limits and upstream failures worth retrying with backoff
+RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 1.5
+
+def _error_response(status_code, body):
+    """
+    Uniform failure shape for non-2xx responses and 200s carrying an error body.
+    OpenRouter errors look like {"error": {"code": ..., "message": ...}}.
+    """
+    error = body.get('error') if isinstance(body, dict) else None
+    if isinstance(error, dict):
+        message = error.get('message') or str(error)
+        status_code = error.get('code', status_code)
+    else:
+        message = str(error or body)
+    return {
+        'success': False,
+        'error': f"OpenRouter error {status_code}: {message}",
+        'retryable': status_code in RETRYABLE_STATUSES
+    }
+
+def _handle_response(status_code, body):
+    """Return the completion body on success, otherwise a uniform error dict"""
+    if 200 <= status_code < 300 and isinstance(body, dict) and 'error' not in body:
+        return body
+    logger.info("OpenRouter returned an error, status: %s", status_code)
+    return _error_response(status_code, body)
+
+def _safe_json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {'error': response.text}
+
+def _retry_delay(retry_after, attempt):
+    """Honour Retry-After when given in seconds, otherwise back off exponentially"""
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return BACKOFF_FACTOR * (2 ** attempt)
+
+# Connection settings shared by the OpenRouter and Batch API clients. HTTP/2 lets
+# concurrent requests multiplex over one warm TLS connection. Reads get a longer timeout since
+# a non-streamed completion sends nothing until it is done.
+_TIMEOUT = httpx.Timeout(60.0, connect=5.0, read=180.0)
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+# Shared client so repeated calls reuse the pooled connection
+_CLIENT = httpx.Client(http2=True, timeout=_TIMEOUT, limits=_LIMITS, headers=_build_headers())
+
+# Same pooling for the Batch API, which lives on a different host and key
+_BATCH_CLIENT = httpx.Client(
+    http2=True,
+    base_url=BATCH_API_URL,
+    timeout=_TIMEOUT,
+    limits=_LIMITS,
+    headers={"Authorization": f"Bearer {BATCH_API_KEY}"}
+)
 
 def send_ai_request(prompt, model, temperature=0.7, max_tokens=None):
     """Send a request to the OpenRouter API and return the response"""
-    logger.info(f"Sending request to OpenRouter, model: {model}")
-    logger.info(f"Request payload prepared with prompt length: {len(prompt)} characters")
+    logger.info("Sending request to OpenRouter, model: %s", model)
+    logger.debug("Request payload prepared with prompt length: %d characters", len(prompt))
+    payload = _build_payload(prompt, model, temperature, max_tokens)
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = _CLIENT.post(OPENROUTER_URL, json=payload)
+            logger.info("Received response from OpenRouter, status: %s", response.status_code)
+            result = _handle_response(response.status_code, _safe_json(response))
+            retry_after = response.headers.get("Retry-After")
+        except httpx.HTTPError as e:
+            logger.info("OpenRouter API request failed: %s", e)
+            result = {
+                'success': False,
+                'error': f"Request failed: {str(e)}",
+                'retryable': True
+            }
+            retry_after = None
+
+        if not result.get('retryable') or attempt == MAX_RETRIES:
+            return result
+        time.sleep(_retry_delay(retry_after, attempt))
+
+def send_ai_request_stream(prompt, model, temperature=0.7, max_tokens=None, response_holder=None):
+    """
+    Stream a completion from OpenRouter, yielding content deltas as they arrive.
+    When the stream ends, response_holder (if given) is filled with a response
+    in the same shape as send_ai_request so parse_ai_response still works.
+    """
+    logger.info("Streaming request to OpenRouter, model: %s", model)
+    if response_holder is None:
+        response_holder = {}
+    payload = _build_payload(prompt, model, temperature, max_tokens)
+    payload["stream"] = True
+    payload["usage"] = {"include": True}
+
+    chunks = []
+    usage = None
+    for attempt in range(MAX_RETRIES + 1):
+        result = None
+        retry_after = None
+        try:
+            with _CLIENT.stream("POST", OPENROUTER_URL, json=payload) as response:
+                logger.info("Opened stream from OpenRouter, status: %s", response.status_code)
+                if response.is_error:
+                    response.read()
+                    result = _error_response(response.status_code, _safe_json(response))
+                    retry_after = response.headers.get("Retry-After")
+                else:
+                    for line in response.iter_lines():
+                        # Skip keep-alive comments and anything that isn't a data frame
+                        if not line or not line.startswith("data: "):
+                            continue
+                        data = line[len("data: "):]
+                        if data == "[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        if "error" in chunk:
+                            result = _error_response(response.status_code, chunk)
+                            break
+                        if chunk.get("usage"):
+                            usage = chunk["usage"]
+                        choices = chunk.get("choices") or []
+                        delta = choices[0].get("delta", {}).get("content") if choices else None
+                        if delta:
+                            chunks.append(delta)
+                            yield delta
+        except (httpx.HTTPError, ValueError) as e:
+            logger.info("OpenRouter API stream failed: %s", e)
+            result = {
+                'success': False,
+                'error': f"Request failed: {str(e)}",
+                'retryable': True
+            }
+
+        if result is None:
+            break
+        # Only retry before the first delta, otherwise the caller would see the text twice
+        if chunks or not result.get('retryable') or attempt == MAX_RETRIES:
+            response_holder.update(result)
+            return
+        time.sleep(_retry_delay(retry_after, attempt))
+
+    response_holder.update({
+        'choices': [{'message': {'role': 'assistant', 'content': "".join(chunks)}}],
+        'usage': usage or {}
+    })
+
+def supports_batch(model):
+    """Whether the batch endpoint can serve this model (openai/gpt-4o -> provider openai)"""
+    return model.split("/", 1)[0] in BATCH_MODEL_PROVIDERS
+
+def submit_batch(prompts, model, temperature=0.7, max_tokens=None):
+    """
+    Queue prompts on an OpenAI-compatible Batch API (24h turnaround, discounted pricing).
+    OpenRouter has no batch endpoint, so this goes to BATCH_API_URL with BATCH_API_KEY;
+    the provider prefix is dropped from the model id (openai/gpt-4o -> gpt-4o).
+    
+    Args:
+        prompts (list): [{"custom_id": str, "prompt": str}, ...]
+        model (str): Model id as used in the app
+        
+    Returns:
+        dict: {'success': True, 'batch_id': ...} or a uniform error dict
+    """
+    logger.info("Submitting batch of %d prompts, model: %s", len(prompts), model)
+    if not supports_batch(model):
+        return {
+            'success': False,
+            'error': f"Model {model} is not available on the batch endpoint",
+            'retryable': False
+        }
+    batch_model = model.split("/", 1)[-1]
+
+    lines = []
+    for item in prompts:
+        body = _build_payload(item["prompt"], batch_model, temperature, max_tokens)
+        # provider routing is OpenRouter-specific
+        body.pop("provider", None)
+        lines.append(json.dumps({
+            "custom_id": item["custom_id"],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body
+        }))
+
     try:
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}"
-            },
-            data=json.dumps({
-                "model": model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt,
-                        "temperature": temperature,
-                        "max_tokens": None
-                    }
-                ]
-            })
+        upload = _BATCH_CLIENT.post(
+            "/files",
+            data={"purpose": "batch"},
+            files={"file": ("batch.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")}
         )
-        logger.info(f"Received response from OpenRouter, status: {response.status_code}")
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.info(f"OpenRouter API request failed: {str(e)}")
+        if not upload.is_success:
+            return _error_response(upload.status_code, _safe_json(upload))
+
+        batch = _BATCH_CLIENT.post(
+            "/batches",
+            json={
+                "input_file_id": upload.json()["id"],
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h"
+            }
+        )
+        if not batch.is_success:
+            return _error_response(batch.status_code, _safe_json(batch))
+        batch_id = batch.json()["id"]
+        logger.info("Batch submitted with ID: %s", batch_id)
+        return {'success': True, 'batch_id': batch_id}
+    except httpx.HTTPError as e:
+        logger.info("Batch submission failed: %s", e)
         return {
             'success': False,
-            'error': f"Request failed: {str(e)}"
+            'error': f"Request failed: {str(e)}",
+            'retryable': True
         }
 
+def retrieve_batch(batch_id):
+    """
+    Check a batch job. Once it has completed, the output file is downloaded.
+    
+    Returns:
+        dict: {'status': ..., 'results': {custom_id: chat completion response}} (results empty until completed).
+        Requests that failed inside the batch come back as {'error': ...}, which parse_ai_response reports as a failure.
+    """
+    batch = _BATCH_CLIENT.get(f"/batches/{batch_id}")
+    batch.raise_for_status()
+    batch = batch.json()
+
+    results = {}
+    if batch["status"] == "completed":
+        # Failed requests are written to the error file rather than the output file
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            if not file_id:
+                continue
+            output = _BATCH_CLIENT.get(f"/files/{file_id}/content")
+            output.raise_for_status()
+            for line in output.text.splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    response = record.get("response") or {}
+                    body = response.get("body")
+                    if record.get("error") or not body:
+                        logger.info("Batch %s request %s failed: %s", batch_id, record["custom_id"], record.get("error"))
+                        body = {'error': record.get("error") or f"Batch request returned no body (status {response.get('status_code')})"}
+                    results[record["custom_id"]] = body
+    return {'status': batch["status"], 'results': results}
+
 def parse_ai_response(response):
     """Extract the content and usage metrics from API response"""
-    logger.info("Parsing OpenRouter API response")
+    logger.debug("Parsing OpenRouter API response")
+    if not response.get('choices'):
+        error = response.get('error', 'Response contained no choices')
+        logger.error("OpenRouter request did not succeed: %s", error)
+        return {
+            'content': None,
+            'usage': None,
+            'success': False,
+            'error': error if isinstance(error, str) else str(error),
+            'retryable': response.get('retryable', False),
+            'response': response
+        }
     try:
         content = response['choices'][0]['message']['content']
         usage = response['usage']
-        logger.info(f"Successfully parsed response with {usage.get('total_tokens', 'unknown')} total tokens")
+        logger.info("Successfully parsed response with %s total tokens", usage.get('total_tokens', 'unknown'))
         return {
             'content': content,
             'usage': usage,
             'success': True
         }
     except (KeyError, IndexError) as e:
-        logger.error(f"Failed to parse OpenRouter response: {str(e)}")
+        logger.error("Failed to parse OpenRouter response: %s", e)
         return {
             'content': None,
             'usage': None,
@@ -2,7 +2,8 @@ def generate_prompt(
     papers_with_content,
     goal,
     return_format,
-    directions
+    directions,
+    max_chars_per_paper=40_000
 ):
     """
     Generate a minimal, straightforward prompt for research idea generation.
@@ -12,28 +13,34 @@ def generate_prompt(
         goal (str): The research goal/approach from the prompt builder
         return_format (str): The desired output format
         directions (str): Additional directions/warnings for generation
+        max_chars_per_paper (int): Cap on characters included from each paper; None disables it
         
     Returns:
         str: The complete prompt ready to send to OpenRouter
     """
-    prompt = ""
+    parts = []
     
     # Add goal if provided
     if goal:
-        prompt += f"{goal}\n\n"
+        parts.append(f"{goal}\n\n")
     
     # Add return format if provided
     if return_format:
-        prompt += f"{return_format}\n\n"
+        parts.append(f"{return_format}\n\n")
     
     # Add directions if provided
     if directions:
-        prompt += f"{directions}\n\n"
+        parts.append(f"{directions}\n\n")
     
     # Add papers with minimal formatting
-    prompt += "Here are the papers to work on.\n\n"
+    parts.append("Here are the papers to work on.\n\n")
     for i, (paper_id, paper_data) in enumerate(papers_with_content.items()):
-        prompt += f"### Paper {i+1}: {paper_data['title']}\n"
-        prompt += f"{paper_data['content']}\n\n"
-        
-    return prompt.strip()
\ No newline at end of file
+        parts.append(f"### Paper {i+1}: {paper_data['title']}\n")
+        content = paper_data['content']
+        if max_chars_per_paper and len(content) > max_chars_per_paper:
+            content = content[:max_chars_per_paper] + "\n\n[Paper truncated for length]"
+        parts.append(content)
+        parts.append("\n\n")
+    
+    # Join once rather than growing a string, which would recopy every paper on each +=
+    return "".join(parts).strip()
\ No newline at end of file
@@ -1,6 +1,11 @@
+import asyncio
+import functools
+import hashlib
 from typing import Optional, List, Dict
+import httpx
+import streamlit as st
 from supabase import create_client, Client
-from backend.config import SUPABASE_URL, SUPABASE_KEY, PAPERS_TABLE, logger
+from backend.config import SUPABASE_URL, SUPABASE_KEY, PAPERS_TABLE, GENERATIONS_TABLE, GENERATION_CACHE_TABLE, logger
 
 def create_supabase_client(supabase_url: str, supabase_key: str):
     """
@@ -11,108 +16,207 @@ def create_supabase_client(supabase_url: str, supabase_key: str):
     supabase_client: Client = create_client(supabase_url, supabase_key)
     return supabase_client
 
+@st.cache_resource
+def get_supabase() -> Client:
+    """
+    Returns a single Supabase client shared across all sessions,
+    so its connection pool is reused instead of rebuilt per browser session.
+    """
+    return create_supabase_client(SUPABASE_URL, SUPABASE_KEY)
+
+@st.cache_data(ttl=300, show_spinner=False)
 def get_papers(
-    supabase_client: Client,
+    _supabase_client: Client,
     table_name: str,
     paper_status: Optional[str] = None,
-    primary_area: Optional[str] = None
-) -> List[Dict]:
+    primary_area: Optional[str] = None,
+    page: int = 0,
+    page_size: int = 50
+) -> tuple[List[Dict], int]:
     """
-    Fetch papers with optional status and area filters
-    Returns list of paper objects with id, title, status, area
+    Fetch one page of papers with optional status and area filters
+    Returns (list of paper objects with id, title, status, area; total matching count)
+    Raises on Supabase errors.
+    Cached for 5 minutes per (table_name, paper_status, primary_area, page, page_size); the client is not hashed.
     """
-    logger.info(f"Fetching papers with filters - status: {paper_status}, area: {primary_area}")
-    logger.info("Setting up the search query.")
-    query = supabase_client.table(table_name).select('id', 'title', 'primary_area', 'paper_status')
+    logger.info("Fetching papers with filters - status: %s, area: %s, page: %s", paper_status, primary_area, page)
+    query = _supabase_client.table(table_name).select('id', 'title', 'primary_area', 'paper_status', count="exact")
     
     if paper_status:
-        logger.info(f"Adding the paper_status filter: {paper_status}")
         query = query.eq('paper_status', paper_status)
     if primary_area:
-        logger.info(f"Adding the primary_area filter: {primary_area}")
         query = query.eq('primary_area', primary_area)
     
-    logger.info(f"Executing the search query.")
+    # Stable order so that page ranges don't overlap between requests
+    start = page * page_size
+    query = query.order('id').range(start, start + page_size - 1)
+    
     try:
         response = query.execute()
-        if response:
-            logger.info(f"Response received.")
-            list_of_papers = response.data
     except Exception as e:
-        logger.info(f"Error during Supabase call: {e}")
-    return list_of_papers
+        # Re-raise so the failure reaches the caller and isn't cached as an empty result
+        logger.error("Error during Supabase call: %s", e)
+        raise
+    return response.data or [], response.count or 0
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_unique_filter_values(_client: Client, table_name: str) -> tuple[list, list]:
+    """
+    Get unique status and area values.
+    Uses the get_filter_values RPC (sql/get_filter_values.sql) for the papers table,
+    falling back to reading both columns if the function isn't available.
+    Cached for 5 minutes per table_name; the client is not hashed.
+    """
+    if table_name == PAPERS_TABLE:
+        try:
+            response = _client.rpc("get_filter_values").execute()
+            row = response.data[0] if response.data else {}
+            statuses = sorted(row.get('statuses') or [])
+            areas = sorted(row.get('areas') or [])
+            logger.info("Retrieved %d statuses and %d areas via RPC", len(statuses), len(areas))
+            return statuses, areas
+        except Exception as e:
+            logger.warning("get_filter_values RPC failed, falling back to column scan: %s", e)
 
-def get_unique_filter_values(client: Client, table_name: str) -> tuple[list, list]:
-    """Get unique status and area values directly from table"""
-    status_query = client.table(table_name).select('paper_status').execute()
-    area_query = client.table(table_name).select('primary_area').execute()
+    status_query = _client.table(table_name).select('paper_status').execute()
+    area_query = _client.table(table_name).select('primary_area').execute()
     
-    statuses = sorted(list(set(p['paper_status'] for p in status_query.data)))
-    areas = sorted(list(set(p['primary_area'] for p in area_query.data)))
+    statuses = sorted({p['paper_status'] for p in status_query.data if p['paper_status']})
+    areas = sorted({p['primary_area'] for p in area_query.data if p['primary_area']})
     
-    logger.info(f"Retrieved {len(statuses)} statuses and {len(areas)} areas")
+    logger.info("Retrieved %d statuses and %d areas", len(statuses), len(areas))
     return statuses, areas
 
 
-def get_paper_markdown(supabase_client, paper_id, table_name="ICLR_25_papers"):
+@st.cache_data(ttl=300, show_spinner=False)
+def get_app_bootstrap(
+    _client: Client,
+    table_name: str,
+    paper_status: Optional[str] = None,
+    primary_area: Optional[str] = None,
+    page: int = 0,
+    page_size: int = 50
+) -> Dict:
     """
-    Retrieve paper markdown content from Supabase storage.
+    Filter values plus one page of papers in a single call.
+    Uses the app_bootstrap RPC (sql/app_bootstrap.sql) for the papers table,
+    falling back to get_unique_filter_values + get_papers if it isn't available.
+    Returns dict with statuses, areas, papers, total_count
+    """
+    if table_name == PAPERS_TABLE:
+        try:
+            response = _client.rpc("app_bootstrap", {
+                "p_status": paper_status,
+                "p_area": primary_area,
+                "p_limit": page_size,
+                "p_offset": page * page_size
+            }).execute()
+            data = response.data or {}
+            logger.info("Bootstrap retrieved %s papers via RPC", data.get('total_count', 0))
+            return {
+                "statuses": data.get("statuses") or [],
+                "areas": data.get("areas") or [],
+                "papers": data.get("papers") or [],
+                "total_count": data.get("total_count") or 0
+            }
+        except Exception as e:
+            logger.warning("app_bootstrap RPC failed, falling back to separate queries: %s", e)
+
+    statuses, areas = get_unique_filter_values(_client, table_name)
+    papers, total_count = get_papers(_client, table_name, paper_status, primary_area, page, page_size)
+    return {"statuses": statuses, "areas": areas, "papers": papers, "total_count": total_count}
+
+class _PartialMarkdownFetch(Exception):
+    """Some downloads failed: carries what was fetched out of the cached function so it is used but not cached"""
+    def __init__(self, markdown_by_id: Dict[str, str], failed_ids: List[str]):
+        super().__init__(f"Markdown download failed for papers: {', '.join(failed_ids)}")
+        self.markdown_by_id = markdown_by_id
+        self.failed_ids = failed_ids
+
+
+async def _download_signed_urls(urls_by_id: Dict[str, str]) -> Dict[str, str]:
+    """Fetch all signed URLs concurrently and return id -> decoded markdown, skipping papers that fail"""
+    async with httpx.AsyncClient(http2=True, timeout=60.0) as session:
+        responses = await asyncio.gather(*[session.get(url) for url in urls_by_id.values()], return_exceptions=True)
+
+    markdown_by_id = {}
+    for paper_id, response in zip(urls_by_id, responses):
+        if isinstance(response, Exception):
+            logger.error("Failed to download markdown for paper %s: %s", paper_id, response)
+            continue
+        if response.is_error:
+            logger.error("Failed to download markdown for paper %s, status: %s", paper_id, response.status_code)
+            continue
+        try:
+            markdown_by_id[paper_id] = response.content.decode('utf-8')
+        except UnicodeDecodeError as decode_error:
+            logger.error("Failed to decode markdown content for paper %s: %s", paper_id, decode_error)
+    return markdown_by_id
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _fetch_papers_markdown_batch(_supabase_client, paper_ids: tuple, table_name: str) -> Dict[str, str]:
+    """
+    One row lookup for all ids, one signed-URL call per bucket, then a concurrent download.
+    Errors are raised so that a failed or partial fetch is not cached; a partial fetch
+    raises _PartialMarkdownFetch carrying the papers that did download.
+    """
+    rows = _supabase_client.table(table_name).select(
+        "id, md_bucket_path"
+    ).in_("id", list(paper_ids)).execute().data or []
+
+    # Group file paths by bucket so each bucket needs one signing call
+    paths_by_bucket: Dict[str, Dict[str, str]] = {}
+    for row in rows:
+        md_path = row.get("md_bucket_path")
+        if not md_path:
+            logger.warning("No markdown path found for paper %s", row['id'])
+            continue
+        md_bucket, md_file_path = md_path.split('/', 1)
+        paths_by_bucket.setdefault(md_bucket, {})[md_file_path] = row['id']
+
+    urls_by_id = {}
+    for md_bucket, id_by_path in paths_by_bucket.items():
+        signed = _supabase_client.storage.from_(md_bucket).create_signed_urls(list(id_by_path), 60)
+        for item in signed:
+            url = item.get("signedURL") or item.get("signedUrl")
+            if url:
+                urls_by_id[id_by_path[item["path"]]] = url
+            else:
+                logger.warning("Could not sign markdown path %s: %s", item.get('path'), item.get('error'))
+
+    markdown_by_id = asyncio.run(_download_signed_urls(urls_by_id))
+    failed_ids = [paper_id for paper_id in urls_by_id if paper_id not in markdown_by_id]
+    if failed_ids:
+        if not markdown_by_id:
+            raise RuntimeError(f"Markdown download failed for all {len(failed_ids)} papers")
+        raise _PartialMarkdownFetch(markdown_by_id, failed_ids)
+    return markdown_by_id
+
+
+def get_papers_markdown_batch(supabase_client, paper_ids: List[str], table_name: str = PAPERS_TABLE) -> Dict[str, str]:
+    """
+    Retrieve markdown for several papers in a fixed number of roundtrips.
     
     Args:
         supabase_client: Supabase client instance
-        paper_id: ID of the paper in the database
+        paper_ids: IDs of the papers in the database
         table_name: Name of the table containing paper records
         
     Returns:
-        dict: Simple dict with paper_id and markdown_content (or None if unavailable)
+        dict: paper_id -> markdown content, for the papers that could be retrieved
     """
-    logger.info(f"Retrieving markdown for paper ID: {paper_id}")
-    
-    # Create basic result structure with just the ID
-    result = {"paper_id": paper_id, "markdown_content": None}
-    
+    logger.info("Retrieving markdown for %d papers", len(paper_ids))
+    if not paper_ids:
+        return {}
     try:
-        # Get just the markdown path from the paper record
-        response = supabase_client.table(table_name).select(
-            "md_bucket_path"
-        ).eq("id", paper_id).execute()
-        
-        if not response.data or not response.data[0]:
-            logger.warning(f"Paper with ID {paper_id} not found")
-            return result
-            
-        md_path = response.data[0].get("md_bucket_path")
-        
-        # Get markdown content if path is available
-        if md_path:
-            try:
-                # Split at first slash to get bucket and file path
-                md_bucket, md_file_path = md_path.split('/', 1)
-                
-                # Download the raw content
-                md_bytes = supabase_client.storage.from_(md_bucket).download(md_file_path)
-                
-                # Try to decode the content in a separate try-except block
-                try:
-                    result["markdown_content"] = md_bytes.decode('utf-8')
-                    logger.info(f"Markdown content successfully decoded for paper {paper_id}")
-                except UnicodeDecodeError as decode_error:
-                    logger.error(f"Failed to decode markdown content for paper {paper_id}: {decode_error}")
-                    # Keep markdown_content as None
-                
-            except Exception as e:
-                logger.error(f"Error retrieving markdown content for paper {paper_id}: {e}")
-                # markdown_content remains None
-        else:
-            logger.warning(f"No markdown path found for paper {paper_id}")
-            # markdown_content remains None
-                    
-        return result
-        
+        return _fetch_papers_markdown_batch(supabase_client, tuple(sorted(paper_ids)), table_name)
+    except _PartialMarkdownFetch as partial:
+        logger.warning("Skipping %d papers whose markdown could not be downloaded: %s", len(partial.failed_ids), partial.failed_ids)
+        return partial.markdown_by_id
     except Exception as e:
-        logger.error(f"Error in get_paper_markdown for paper {paper_id}: {e}")
-        return result
-
+        logger.error("Error in get_papers_markdown_batch: %s", e)
+        return {}
 
 def insert_generation_to_db(
     supabase_client: Client,
@@ -123,7 +227,9 @@ def insert_generation_to_db(
     source_papers: list = None,
     prompt_text: str = None,
     model_used: str = None,
-    token_usage: dict = None
+    token_usage: dict = None,
+    status: str = None,
+    batch_id: str = None
 ) -> dict:
     """
     Insert a generated research idea into the Generations_table.
@@ -138,11 +244,13 @@ def insert_generation_to_db(
         prompt_text: Optional full prompt text sent to the model
         model_used: Optional identifier for the AI model used
         token_usage: Optional token usage statistics
+        status: Optional generation status, e.g. "pending" for queued batch jobs
+        batch_id: Optional id of the batch job producing this generation
         
     Returns:
         dict: The inserted record from Supabase, or None if insertion failed
     """
-    logger.info(f"Inserting new generation with run_id: {run_id}")
+    logger.info("Inserting new generation with run_id: %s", run_id)
     
     # Prepare data for insertion, handling optional fields
     generation_data = {
@@ -169,21 +277,94 @@ def insert_generation_to_db(
     if token_usage is not None:
         generation_data["token_usage"] = token_usage
     
+    if status is not None:
+        generation_data["status"] = status
+    
+    if batch_id is not None:
+        generation_data["batch_id"] = batch_id
+    
     try:
         # Insert the data into the Generations_table
-        response = supabase_client.table("Generations_table").insert(generation_data).execute()
+        response = supabase_client.table(GENERATIONS_TABLE).insert(generation_data).execute()
         
         if response and response.data:
-            logger.info(f"Successfully inserted generation with ID: {response.data[0].get('id')}")
+            logger.info("Successfully inserted generation with ID: %s", response.data[0].get('id'))
             return response.data[0]
         else:
             logger.error("Insert returned no data")
             return None
             
     except Exception as e:
-        logger.error(f"Error inserting generation: {e}")
+        logger.error("Error inserting generation: %s", e)
+        return None
+
+
+def get_pending_generations(supabase_client: Client) -> List[Dict]:
+    """Return generations queued as batch jobs that haven't completed yet"""
+    response = supabase_client.table(GENERATIONS_TABLE).select(
+        "id, batch_id"
+    ).eq("status", "pending").execute()
+    return response.data or []
+
+
+def update_generation(supabase_client: Client, generation_id, fields: dict) -> dict:
+    """
+    Update an existing generation row, e.g. to fill in a completed batch result.
+    
+    Returns:
+        dict: The updated record from Supabase, or None if the update failed
+    """
+    logger.info("Updating generation %s", generation_id)
+    try:
+        response = supabase_client.table(GENERATIONS_TABLE).update(fields).eq("id", generation_id).execute()
+        return response.data[0] if response.data else None
+    except Exception as e:
+        logger.error("Error updating generation %s: %s", generation_id, e)
         return None
 
+def generation_cache_key(model: str, prompt_text: str) -> str:
+    """Content address for a generation: sha256 of the model and the exact prompt"""
+    return hashlib.sha256((model + "\0" + prompt_text).encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=128)
+def _lookup_cached_generation(supabase_client: Client, cache_key: str) -> dict:
+    # Raises KeyError on a miss: lru_cache doesn't cache exceptions, so only hits are memoized
+    response = supabase_client.table(GENERATION_CACHE_TABLE).select(
+        "content_generated, token_usage"
+    ).eq("cache_key", cache_key).limit(1).execute()
+    if not response.data:
+        raise KeyError(cache_key)
+    return response.data[0]
+
+
+def get_cached_generation(supabase_client: Client, cache_key: str) -> Optional[dict]:
+    """
+    Return a previously stored generation for cache_key, or None.
+    Hits are also kept in-process so repeats skip the Supabase roundtrip.
+    """
+    try:
+        cached = _lookup_cached_generation(supabase_client, cache_key)
+        logger.info("Generation cache hit for key %s", cache_key[:12])
+        return cached
+    except KeyError:
+        return None
+    except Exception as e:
+        logger.error("Error reading generation cache: %s", e)
+        return None
+
+
+def put_cached_generation(supabase_client: Client, cache_key: str, content: str, usage: dict = None) -> None:
+    """Store a generation under cache_key, replacing any earlier entry"""
+    try:
+        supabase_client.table(GENERATION_CACHE_TABLE).upsert({
+            "cache_key": cache_key,
+            "content_generated": content,
+            "token_usage": usage
+        }, on_conflict="cache_key").execute()
+    except Exception as e:
+        logger.error("Error writing generation cache: %s", e)
+
 # if __name__ == "__main__":
 #     client = create_supabase_client(SUPABASE_URL, SUPABASE_KEY)
     # papers = get_papers(client, PAPERS_TABLE, paper_status="Accepted")
@@ -191,10 +372,8 @@ def insert_generation_to_db(
     # print(papers[:2])  # Preview first two
     # for item in papers: 
     #     paper_id = item["id"]
-    #     md_content = get_paper_markdown(client, paper_id="fh7GYa7cjO")
-    #     print(md_content["id"])
-    #     print(md_content["markdown_content"][:30])
+    #     md_content = get_papers_markdown_batch(client, [paper_id])
+    #     print(md_content.get(paper_id, "")[:30])
 
-    # md_content = get_paper_markdown(client, paper_id="fh7GYa7cjO")
-    # print(md_content["paper_id"])
-    # print(md_content["markdown_content"][:30])
+    # md_content = get_papers_markdown_batch(client, ["fh7GYa7cjO"])
+    # print(md_content.get("fh7GYa7cjO", "")[:30])
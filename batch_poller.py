@@ -0,0 +1,38 @@
+"""
+Polls queued batch generations and fills in their results.
+Run periodically, e.g. from cron: */15 * * * * cd /path/to/iclr_brain && python batch_poller.py
+"""
+from backend.config import SUPABASE_URL, SUPABASE_KEY, logger
+from backend.supabase_calls import create_supabase_client, get_pending_generations, update_generation
+from backend.openrouter_calls import retrieve_batch, parse_ai_response
+
+FAILED_BATCH_STATUSES = ("failed", "expired", "cancelled")
+
+def poll_pending_batches(supabase_client):
+    pending = get_pending_generations(supabase_client)
+    logger.info("Polling %d pending batch generations", len(pending))
+
+    for generation in pending:
+        try:
+            batch = retrieve_batch(generation['batch_id'])
+        except Exception as e:
+            logger.error("Could not check batch %s: %s", generation['batch_id'], e)
+            continue
+
+        if batch['status'] == "completed":
+            # Each generation is submitted as its own single-request batch
+            body = next(iter(batch['results'].values()), {})
+            parsed = parse_ai_response(body)
+            if parsed['success']:
+                update_generation(supabase_client, generation['id'], {
+                    "content_generated": parsed['content'],
+                    "token_usage": parsed['usage'],
+                    "status": "completed"
+                })
+            else:
+                update_generation(supabase_client, generation['id'], {"status": "failed"})
+        elif batch['status'] in FAILED_BATCH_STATUSES:
+            update_generation(supabase_client, generation['id'], {"status": "failed"})
+
+if __name__ == "__main__":
+    poll_pending_batches(create_supabase_client(SUPABASE_URL, SUPABASE_KEY))
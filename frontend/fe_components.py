@@ -1,100 +1,134 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import streamlit as st
-from backend.config import logger
-from backend.supabase_calls import insert_generation_to_db
+import streamlit.components.v1 as components
+from dataclasses import dataclass
+from backend.config import PAPERS_TABLE, logger
+from backend.supabase_calls import insert_generation_to_db, get_papers
+
+# Background workers for Supabase inserts, so saving doesn't block the script thread
+_SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+# One page of paper cards with checkboxes, rendered as a single component (styles live in its index.html)
+_paper_list_component = components.declare_component(
+    "paper_list",
+    path=os.path.join(os.path.dirname(__file__), "paper_list_component")
+)
+
+# Prompt builder sections: (header, session state key, text area label, height)
+_PROMPT_FIELDS = (
+    ("Goal", "prompt_goal", "Define the research goal or approach (e.g., combine papers, find gaps, build upon)", 100),
+    ("Return Format", "prompt_return_format", "Specify the format for the generated research idea", 150),
+    ("Directions", "prompt_warnings", "Add any directions, warnings or constraints for the generation process", 100),
+)
+
+def set_selected_papers(papers):
+    """
+    Replace the current selection.
+    selected_paper_ids is the membership index; selected_papers maps id -> paper record for display.
+    """
+    st.session_state.selected_papers = {paper['id']: paper for paper in papers}
+    st.session_state.selected_paper_ids = set(st.session_state.selected_papers)
+
+def _select_paper(paper):
+    st.session_state.selected_paper_ids.add(paper['id'])
+    st.session_state.selected_papers[paper['id']] = paper
+
+def _deselect_paper(paper_id):
+    st.session_state.selected_paper_ids.discard(paper_id)
+    st.session_state.selected_papers.pop(paper_id, None)
+
+def current_page_key():
+    """Identifies which page of which search should be on screen"""
+    search_filters = st.session_state.search_filters
+    return (search_filters["paper_status"], search_filters["primary_area"], st.session_state.page_number)
+
+def _load_current_page(papers_per_page):
+    """
+    Fetch the current page into session state, only when the search or page changed since the last fetch.
+    Returns False if the fetch failed, leaving session state holding a different page.
+    """
+    page_key = current_page_key()
+    if st.session_state.get('loaded_page_key') == page_key:
+        return True
+    try:
+        papers, total_papers = get_papers(
+            st.session_state.supabase_client, 
+            PAPERS_TABLE,
+            **st.session_state.search_filters,
+            page=st.session_state.page_number,
+            page_size=papers_per_page
+        )
+    except Exception as e:
+        st.error(f"Search failed: {e}")
+        return False
+    st.session_state.filtered_papers = papers
+    st.session_state.total_papers = total_papers
+    st.session_state.loaded_page_key = page_key
+    logger.info("Found %s papers", total_papers)
+    return True
+
+def _change_page(delta):
+    st.session_state.page_number += delta
+
+@dataclass(frozen=True)
+class PageView:
+    total_pages: int
+    caption: str
+
+def _paginate(total_count, page, per_page=5):
+    """Everything the pagination controls need for the current page, computed once per render"""
+    total_pages = -(-total_count // per_page)
+    return PageView(
+        total_pages=total_pages,
+        caption=f"Found {total_count} papers | Page {page + 1} of {total_pages}"
+    )
+
+def _apply_page_selection(page_papers, checked_ids):
+    """Reconcile the page's submitted checkboxes with the selection in one pass"""
+    for paper in page_papers:
+        if paper['id'] in checked_ids:
+            if paper['id'] not in st.session_state.selected_paper_ids:
+                _select_paper(paper)
+                logger.debug("Paper with title %s selected.", paper['title'])
+        elif paper['id'] in st.session_state.selected_paper_ids:
+            _deselect_paper(paper['id'])
+            logger.debug("Paper with title %s removed from selection.", paper['title'])
 
 def render_prompt_builder():
     """
     Renders the prompt builder UI component with text fields for Goal, Return Format, 
-    Additional Directions, and Context Dump. Values are stored directly in session state.
+    and Additional Directions. Values are stored directly in session state.
     """
     st.subheader("Prompt Builder")
     
-    # Initialize session state variables if they don't exist
-    if 'prompt_goal' not in st.session_state:
-        st.session_state.prompt_goal = ""
-    if 'prompt_return_format' not in st.session_state:
-        st.session_state.prompt_return_format = ""
-    if 'prompt_warnings' not in st.session_state:
-        st.session_state.prompt_warnings = ""
-    if 'prompt_context_dump' not in st.session_state:
-        st.session_state.prompt_context_dump = ""
-    
-    # Goal section
-    st.markdown("#### Goal")
-    st.text_area(
-        "Define the research goal or approach (e.g., combine papers, find gaps, build upon)",
-        value=st.session_state.prompt_goal,
-        height=100,
-        key="prompt_goal"
-    )
-    
-    # Return Format section
-    st.markdown("#### Return Format")
-    st.text_area(
-        "Specify the format for the generated research idea",
-        value=st.session_state.prompt_return_format,
-        height=150,
-        key="prompt_return_format"
-    )
+    # Initialize session state variables if they don't exist; the keyed widgets below read their values from here
+    for _, key, _, _ in _PROMPT_FIELDS:
+        st.session_state.setdefault(key, "")
     
-    # Warnings section
-    st.markdown("#### Directions")
-    st.text_area(
-        "Add any directions, warnings or constraints for the generation process",
-        value=st.session_state.prompt_warnings,
-        height=100,
-        key="prompt_warnings"
-    )
-    
-    # # Context Dump section
-    # st.markdown("#### Context Dump")
-    # st.text_area(
-    #     "Additional context to include in the prompt",
-    #     value=st.session_state.prompt_context_dump,
-    #     height=150,
-    #     key="prompt_context_dump"
-    # )
+    for header, key, label, height in _PROMPT_FIELDS:
+        st.markdown(f"#### {header}")
+        st.text_area(label, height=height, key=key)
 
 def render_compact_paper_list(papers, title="Papers"):
     """
-    Renders a compact, scrollable list of papers with checkboxes.
+    Renders papers as a single searchable multiselect.
+    One virtualized widget instead of a checkbox per paper.
     """
     st.subheader(title)
     
-    # Create a container with fixed height and scrolling
-    paper_container = st.container()
+    # Keep current selections as options so they survive a new search
+    paper_by_id = dict(st.session_state.selected_papers)
+    paper_by_id.update({paper['id']: paper for paper in papers})
     
-    # Set a fixed height for the paper list with scrolling
-    with paper_container:
-        # Use a scrollable container with CSS
-        st.markdown("""
-            <style>
-            .paper-list {
-                height: 300px;
-                overflow-y: auto;
-                padding-right: 10px;
-                border: 1px solid rgba(49, 51, 63, 0.2);
-                border-radius: 4px;
-                padding: 10px;
-            }
-            </style>
-            """, unsafe_allow_html=True)
-        
-        # Open the scrollable div
-        st.markdown('<div class="paper-list">', unsafe_allow_html=True)
-        
-        # Display papers with checkboxes
-        for paper in papers:
-            if st.checkbox(f"{paper['title']}", key=paper['id']):
-                if paper not in st.session_state.selected_papers:
-                    st.session_state.selected_papers.append(paper)
-                    # logger.info(f"Selected: {paper['id']}")
-            elif paper in st.session_state.selected_papers:
-                st.session_state.selected_papers.remove(paper)
-                # logger.info(f"Deselected: {paper['id']}")
-        
-        # Close the scrollable div
-        st.markdown('</div>', unsafe_allow_html=True)
+    selected_ids = st.multiselect(
+        "Papers",
+        options=list(paper_by_id),
+        format_func=lambda paper_id: f"{paper_by_id[paper_id]['title']}  ({paper_id})",
+        default=list(st.session_state.selected_papers),
+        key="paper_select"
+    )
+    set_selected_papers([paper_by_id[paper_id] for paper_id in selected_ids])
 
 
 def render_compact_paper_list_dropdown(papers, title="Papers"):
@@ -107,11 +141,11 @@ def render_compact_paper_list_dropdown(papers, title="Papers"):
         st.info("No papers available. Use the search filters to find papers.")
         return
     
-    # Create a dict mapping paper titles to paper objects for easy lookup
+    # Dict mapping paper titles to paper objects for easy lookup
     paper_dict = {paper['title']: paper for paper in papers}
     
     # Get currently selected paper titles
-    selected_titles = [paper['title'] for paper in st.session_state.selected_papers]
+    selected_titles = [paper['title'] for paper in st.session_state.selected_papers.values()]
     
     # Show multiselect with current selections
     new_selections = st.multiselect(
@@ -120,149 +154,149 @@ def render_compact_paper_list_dropdown(papers, title="Papers"):
         default=selected_titles
     )
     
-    # Update selected_papers based on multiselect
-    st.session_state.selected_papers = [paper_dict[title] for title in new_selections]
-    
-    # Show warning if too many papers selected
-    if len(st.session_state.selected_papers) > 2:
+    # Reject an over-limit selection before it reaches session state
+    if len(new_selections) > 2:
         st.warning("Maximum 2 papers allowed")
+        return
+    
+    # Nothing changed, keep the current selection as is
+    if set(new_selections) == set(selected_titles):
+        return
+    
+    # Update selected_papers based on multiselect
+    set_selected_papers([paper_dict[title] for title in new_selections])
 
-def render_compact_paper_list_pagination(papers, title="Papers"):
+@st.fragment
+def render_compact_paper_list_pagination(title="Papers", papers_per_page=5):
     """
     Renders papers in a paginated format with more compact paper cards.
+    Runs as a fragment that fetches its own page, so Prev/Next only rerun this block.
     """
     st.subheader(title)
     
+    # Don't show the previous search's papers under the new page's caption
+    if not _load_current_page(papers_per_page):
+        return
+    papers = st.session_state.filtered_papers
+    total_count = st.session_state.total_papers
+    
     if not papers:
         st.info("No papers available. Use the search filters to find papers.")
         return
     
-    # Initialize pagination state if not exists
-    if 'page_number' not in st.session_state:
-        st.session_state.page_number = 0
-    
-    # Set papers per page - increase this number for more papers per page
-    papers_per_page = 5  # Increased from 5 to 10
-    
-    # Calculate total pages
-    total_pages = len(papers) // papers_per_page
-    if len(papers) % papers_per_page > 0:
-        total_pages += 1
+    page = st.session_state.page_number
+    page_view = _paginate(total_count, page, papers_per_page)
     
     # Show papers count and pagination info
-    st.caption(f"Found {len(papers)} papers | Page {st.session_state.page_number + 1} of {total_pages}")
-    
-    # Get current page of papers
-    start_idx = st.session_state.page_number * papers_per_page
-    end_idx = min(start_idx + papers_per_page, len(papers))
-    current_page_papers = papers[start_idx:end_idx]
+    st.caption(page_view.caption)
     
-    # Add CSS to make elements more compact
-    st.markdown("""
-        <style>
-        /* Reduce vertical padding in paper containers */
-        .paper-card {
-            margin: 0px 0px !important;
-            padding: 0px 0px !important;
-        }
-        /* Make dividers thinner */
-        .thin-divider {
-            margin: 0px 0px !important;
-            padding: 0px !important;
-        }
-        /* Smaller text for titles */
-        .paper-title {
-            margin: 0px !important;
-            font-size: 18px !important;
-            line-height: 1.2 !important;
-        }
-        </style>
-    """, unsafe_allow_html=True)
-    
-    # Display current page of papers
-    for paper in current_page_papers:
-        # Create a container for each paper with custom class
-        st.markdown('<div class="paper-card">', unsafe_allow_html=True)
-        
-        # Use columns for paper info and selection
-        col1, col2 = st.columns([5, 1])
-        
-        with col1:
-            # Use custom styled title
-            st.markdown(f'<div class="paper-title">{paper["title"]}</div>', unsafe_allow_html=True)
-        
-        with col2:
-            # Checkbox for selection
-            is_selected = paper in st.session_state.selected_papers
-            if st.checkbox("Select Paper", value=is_selected, key=f"select_{paper['id']}", label_visibility="collapsed"):
-                if paper not in st.session_state.selected_papers:
-                    st.session_state.selected_papers.append(paper)
-                    logger.info(f"Paper with title {paper['title']} selected.")
-            elif paper in st.session_state.selected_papers:
-                st.session_state.selected_papers.remove(paper)
-                logger.info(f"Paper with title {paper['title']} removed from selection.")
-        
-        # Close the paper card div
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Add a thin divider between papers
-        st.markdown('<hr class="thin-divider">', unsafe_allow_html=True)
+    # Papers are already paged server-side, so this is the current page.
+    # Display current page of papers as one component instead of several widgets per paper.
+    # It only reports back when "Update selection" is clicked, so toggling checkboxes doesn't rerun.
+    submitted = _paper_list_component(
+        papers=[{"id": paper['id'], "title": paper['title']} for paper in papers],
+        selected_ids=[paper['id'] for paper in papers if paper['id'] in st.session_state.selected_paper_ids],
+        key=f"paper_list_{page}",
+        default=None
+    )
+    # The component keeps returning its last value, so apply each submission only once
+    if submitted and submitted["nonce"] != st.session_state.get('_applied_selection_nonce'):
+        st.session_state._applied_selection_nonce = submitted["nonce"]
+        _apply_page_selection(papers, set(submitted["selected_ids"]))
+        # The selection is shown and used outside this fragment, so refresh the whole app
+        st.rerun()
     
-    # Pagination controls - more compact layout
-    col1, col2, col3 = st.columns([1, 2, 1])
+    # Pagination controls - the page number is already in the caption above, so the middle column stays empty
+    col1, _, col3 = st.columns([1, 2, 1])
     
     with col1:
-        if st.button("← Prev", disabled=st.session_state.page_number <= 0, use_container_width=True):
-            st.session_state.page_number -= 1
-            st.rerun()
-    
-    with col2:
-        st.caption(f"Page {st.session_state.page_number + 1} of {total_pages}", unsafe_allow_html=True)
+        st.button("← Prev", disabled=page <= 0, use_container_width=True,
+                  on_click=_change_page, args=(-1,))
     
     with col3:
-        if st.button("Next →", disabled=st.session_state.page_number >= total_pages - 1, use_container_width=True):
-            st.session_state.page_number += 1
+        st.button("Next →", disabled=page >= page_view.total_pages - 1, use_container_width=True,
+                  on_click=_change_page, args=(1,))
+
+def _collect_save_result():
+    """
+    Move the outcome of a finished background save into session state.
+    Returns False while the save is still running, True otherwise.
+    """
+    future = st.session_state.get('save_future')
+    if future is None:
+        return True
+    try:
+        result = future.result(timeout=0.05)
+    except FutureTimeoutError:
+        return False
+    except Exception as e:
+        st.session_state.save_error = str(e)
+    else:
+        if result:
+            st.session_state.save_successful = True
+            st.session_state.generating = True 
+            st.session_state.content_generated = True
+        else:
+            st.session_state.save_error = "Generation could not be saved."
+    del st.session_state.save_future
+    return True
+
+@st.fragment(run_every=1)
+def _poll_save():
+    """Re-checks the pending save every second; refreshes the app once it has finished"""
+    with st.spinner("Saving…"):
+        if _collect_save_result():
             st.rerun()
 
-def render_save_generation_form(parsed_response, run_id, selected_papers, prompt_generated, selected_model, supabase_client):
-    # Use a simple callback function to handle the save
-    def save_to_db():
-        try:
-            content = parsed_response['content']
-            tags = [tag.strip() for tag in st.session_state.tags_input.split(',')] if st.session_state.tags_input else []
-            source_papers = [paper['id'] for paper in selected_papers]
-            
-            result = insert_generation_to_db(
-                supabase_client=supabase_client,
-                run_id=run_id,
-                content_generated=content,
-                tags=tags,
-                source_papers=source_papers,
-                prompt_text=prompt_generated,
-                model_used=selected_model,
-                token_usage=parsed_response.get('usage', None),
-                score=None
-            )
-            
-            if result:
-                st.session_state.save_successful = True
-                st.session_state.generating = True 
-                st.session_state.content_generated = True
-            
-        except Exception as e:
-            st.session_state.save_error = str(e)
+def _save_to_db(parsed_response, run_id, selected_paper_ids, prompt_generated, selected_model, supabase_client):
+    """Save Generation callback: submits the insert to the background executor"""
+    try:
+        content = parsed_response['content']
+        # Split and strip in one pass, dropping empty tags from stray or trailing commas
+        tags = list(filter(None, (tag.strip() for tag in (st.session_state.tags_input or '').split(','))))
+        source_papers = list(selected_paper_ids)
+        
+        st.session_state.save_error = ""
+        st.session_state.save_future = _SAVE_EXECUTOR.submit(
+            insert_generation_to_db,
+            supabase_client=supabase_client,
+            run_id=run_id,
+            content_generated=content,
+            tags=tags,
+            source_papers=source_papers,
+            prompt_text=prompt_generated,
+            model_used=selected_model,
+            token_usage=parsed_response.get('usage', None),
+            score=None
+        )
+        
+    except Exception as e:
+        st.session_state.save_error = str(e)
+
+def render_save_generation_form(parsed_response, run_id, selected_paper_ids, prompt_generated, selected_model, supabase_client):
+    # Save still running in the background? Poll it instead of showing the form again
+    if not _collect_save_result():
+        _poll_save()
+        return False
+    
+    save_successful = st.session_state.get('save_successful', False)
+    save_error = st.session_state.get('save_error')
     
     # Already saved?
-    if st.session_state.get('save_successful', False):
+    if save_successful:
         st.success("Generation saved successfully!")
         return True
     
     # Show any previous errors
-    if 'save_error' in st.session_state and st.session_state.save_error:
-        st.error(f"Error: {st.session_state.save_error}")
+    if save_error:
+        st.error(f"Error: {save_error}")
     
     # Simple text input with callback on button click
     st.text_input("Tags (comma-separated)", key="tags_input")
-    st.button("Save Generation", on_click=save_to_db)
+    st.button(
+        "Save Generation",
+        on_click=_save_to_db,
+        args=(parsed_response, run_id, selected_paper_ids, prompt_generated, selected_model, supabase_client),
+    )
     
-    return st.session_state.get('save_successful', False)
\ No newline at end of file
+    return save_successful
\ No newline at end of file
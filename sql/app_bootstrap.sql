@@ -0,0 +1,35 @@
+-- Everything the app needs on first render in one roundtrip: distinct filter values,
+-- one page of papers and the total match count.
+-- Called from backend/supabase_calls.py::get_app_bootstrap via supabase_client.rpc("app_bootstrap", {...}).
+create or replace function app_bootstrap(
+    p_status text default null,
+    p_area text default null,
+    p_limit int default 50,
+    p_offset int default 0
+)
+returns jsonb
+language sql
+stable
+as $$
+    with filtered as (
+        select id, title, primary_area, paper_status
+        from "ICLR_25_papers"
+        where (p_status is null or paper_status = p_status)
+          and (p_area is null or primary_area = p_area)
+    )
+    select jsonb_build_object(
+        'statuses', (
+            select coalesce(jsonb_agg(distinct paper_status order by paper_status), '[]'::jsonb)
+            from "ICLR_25_papers" where paper_status is not null
+        ),
+        'areas', (
+            select coalesce(jsonb_agg(distinct primary_area order by primary_area), '[]'::jsonb)
+            from "ICLR_25_papers" where primary_area is not null
+        ),
+        'papers', (
+            select coalesce(jsonb_agg(to_jsonb(page) order by page.id), '[]'::jsonb)
+            from (select * from filtered order by id limit p_limit offset p_offset) page
+        ),
+        'total_count', (select count(*) from filtered)
+    );
+$$;
@@ -0,0 +1,12 @@
+-- Content-addressed cache of generations, keyed on sha256(model || '\0' || prompt).
+-- See generation_cache_key / get_cached_generation / put_cached_generation in backend/supabase_calls.py.
+create table if not exists generation_cache (
+    id bigint generated always as identity primary key,
+    cache_key text not null,
+    content_generated text not null,
+    token_usage jsonb,
+    created_at timestamptz not null default now()
+);
+
+create unique index if not exists generation_cache_key_idx
+    on generation_cache (cache_key);
@@ -0,0 +1,7 @@
+-- Tracks generations queued on the Batch API; see batch_poller.py.
+alter table "Generations_table"
+    add column if not exists status text,
+    add column if not exists batch_id text;
+
+create index if not exists generations_pending_idx
+    on "Generations_table" (status) where status = 'pending';
@@ -0,0 +1,12 @@
+-- Distinct filter values for the sidebar, computed server-side in one roundtrip.
+-- Called from backend/supabase_calls.py::get_unique_filter_values via supabase_client.rpc("get_filter_values").
+create or replace function get_filter_values()
+returns table(statuses text[], areas text[])
+language sql
+stable
+as $$
+    select
+        array_agg(distinct paper_status order by paper_status) filter (where paper_status is not null),
+        array_agg(distinct primary_area order by primary_area) filter (where primary_area is not null)
+    from "ICLR_25_papers";
+$$;
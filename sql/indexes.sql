@@ -0,0 +1,3 @@
+-- Keeps the filtered, paged paper search in get_papers an index range scan.
+create index if not exists iclr_25_papers_status_area_idx
+    on "ICLR_25_papers" (paper_status, primary_area);